@@ -19,6 +19,7 @@ import cartopy.crs as ccrs
 import colorcet as cc
 from utils import (
     sum_total_emissions,
+    sum_total_emissions_raw,
     count_obs_in_mask,
     plot_field,
     filter_tropomi,
@@ -359,14 +360,17 @@ def estimate_averaging_kernel(
 
     # Prior emissions
     preview_cache = os.path.join(preview_dir, "OutputDir")
-    hemco_diags_file = [
-        f for f in os.listdir(preview_cache) if "HEMCO_diagnostics" in f
-    ][0]
+    with os.scandir(preview_cache) as entries:
+        hemco_diags_file = next(
+            e.name for e in entries if "HEMCO_diagnostics" in e.name
+        )
     prior_pth = os.path.join(preview_cache, hemco_diags_file)
-    prior = xr.load_dataset(prior_pth)["EmisCH4_Total"].isel(time=0)
+    # Open the diagnostics once and only load the variables used below
+    with xr.open_dataset(prior_pth) as prior_diags:
+        prior = prior_diags["EmisCH4_Total"].isel(time=0).load()
+        areas = prior_diags["AREA"].load()
 
     # Compute total emissions in the region of interest
-    areas = xr.load_dataset(prior_pth)["AREA"]
     total_prior_emissions = sum_total_emissions(prior, areas, mask)
     outstring1 = (
         f"Total prior emissions in region of interest = {total_prior_emissions} Tg/y \n"
@@ -378,7 +382,8 @@ def estimate_averaging_kernel(
     # ----------------------------------
 
     # Paths to tropomi data files
-    tropomi_files = [f for f in os.listdir(tropomi_cache) if ".nc" in f]
+    with os.scandir(tropomi_cache) as entries:
+        tropomi_files = [e.name for e in entries if ".nc" in e.name]
     tropomi_paths = [os.path.join(tropomi_cache, f) for f in tropomi_files]
 
     # Latitude/longitude bounds of the inversion domain
@@ -448,15 +453,29 @@ def estimate_averaging_kernel(
     # bin observations into gridcells and map onto statevector
     observation_counts = add_observation_counts(df, state_vector, lat_step, lon_step)
 
+    # Extract plain arrays once so each element only does NumPy work
+    # Require identical grids and dimension order before dropping coordinates
+    prior_a, areas_a, labels_a = xr.align(
+        prior, areas, state_vector_labels, join="exact"
+    )
+    dims = labels_a.dims
+    # emissions * areas is the same for every element, so compute it once
+    prior_x_areas = (prior_a * areas_a).transpose(*dims).values
+    labels = labels_a.values
+    # observation counts live on the merged grid, so use its labels
+    obs_labels_da = observation_counts["StateVector"]
+    obs_counts = observation_counts["count"].transpose(*obs_labels_da.dims).values
+    obs_labels = obs_labels_da.values
+
     # parallel processing function
     def process(i):
-        mask = state_vector_labels == i
+        mask = labels == i
         # prior emissions for each element (in Tg/y)
-        emissions_temp = sum_total_emissions(prior, areas, mask)
+        emissions_temp = sum_total_emissions_raw(prior_x_areas, mask)
         # append the calculated length scale of element
-        L_temp = L_native * state_vector_labels.where(mask).count().item()
+        L_temp = L_native * np.count_nonzero(mask)
         # append the number of obs in each element
-        num_obs_temp = np.nansum(observation_counts["count"].where(mask).values)
+        num_obs_temp = np.nansum(obs_counts[obs_labels == i])
         return emissions_temp, L_temp, num_obs_temp
 
     # in parallel, create lists of emissions, number of observations,
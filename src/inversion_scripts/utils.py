@@ -1,31 +1,99 @@
 import numpy as np
 import xarray as xr
-from functools import partial
+from functools import partial, lru_cache
 from shapely.geometry.polygon import Polygon
 from pyproj import Geod
-from functools import partial
 from itertools import product
 import shapely.ops as ops
 import cartopy
 import cartopy.crs as ccrs
+import numexpr as ne
 import pickle
 
 
 def save_obj(obj, name):
-    """Save something with Pickle."""
+    """
+    Save something with Pickle.
+    Protocol 5 (Python >= 3.8) writes numpy array buffers straight to the
+    file; pinning it keeps files readable if HIGHEST_PROTOCOL moves on.
+    """
 
     with open(name, "wb") as f:
-        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(obj, f, protocol=5)
 
 
-def save_netcdf(ds, save_path, comp_level=1):
-    """Save an xarray dataset to netcdf."""
-    ds.to_netcdf(
-        save_path,
-        encoding={v: {"zlib": True, "complevel": comp_level} for v in ds.data_vars},
+def default_chunksizes(var, max_side=256):
+    """
+    One HDF5 chunk per 2-D (lat/lon) field, to avoid paying the compressor
+    setup cost on many tiny chunks. Each of the two trailing dimensions is
+    capped at max_side (max_side**2 for 1-D variables) so large arrays stay
+    well below HDF5's 4 GiB chunk limit. Returns None, leaving the choice to
+    HDF5, for scalar variables and variables with a zero-length dimension.
+    """
+    if var.ndim == 0 or 0 in var.shape:
+        return None
+    if var.ndim == 1:
+        return (min(var.shape[0], max_side**2),)
+    return tuple(1 for _ in var.shape[:-2]) + tuple(
+        min(s, max_side) for s in var.shape[-2:]
     )
 
 
+def save_netcdf(ds, save_path, comp_level=1, compressor="zlib", chunksizes=None):
+    """
+    Save an xarray dataset to netcdf.
+    compressor="blosc" writes Blosc-Zstd compressed variables through h5netcdf
+    and hdf5plugin, which is much faster than zlib. Reading those files needs
+    the HDF5 Blosc filter, so keep the zlib default for GEOS-Chem/HEMCO inputs.
+    chunksizes optionally maps variable names to HDF5 chunk shapes; other
+    variables are written with one chunk per 2-D field.
+    comp_level=0 writes uncompressed variables with the default netCDF4
+    engine, for intermediate files that are read back right away. The
+    compressor setting is ignored, any compression or chunking inherited
+    from the source file is cleared, and only explicit chunksizes are used.
+    """
+    if chunksizes is None:
+        chunksizes = {}
+
+    if comp_level == 0:
+        encoding = {}
+        for v in ds.data_vars:
+            encoding[v] = {"zlib": False}
+            if v in chunksizes:
+                encoding[v]["chunksizes"] = chunksizes[v]
+        ds.to_netcdf(save_path, encoding=encoding)
+        return
+
+    if compressor == "zlib":
+        filters = {"zlib": True, "complevel": comp_level, "shuffle": True}
+        engine = None
+    elif compressor == "blosc":
+        try:
+            import h5netcdf
+            import hdf5plugin
+        except ImportError as err:
+            raise ImportError(
+                'compressor="blosc" requires the h5netcdf and hdf5plugin packages; '
+                "install them or update the conda environment from envs/"
+            ) from err
+
+        blosc = hdf5plugin.Blosc(
+            cname="zstd", clevel=comp_level, shuffle=hdf5plugin.Blosc.SHUFFLE
+        )
+        filters = dict(blosc)
+        engine = "h5netcdf"
+    else:
+        raise ValueError('compressor must be "zlib" or "blosc"')
+
+    encoding = {}
+    for v in ds.data_vars:
+        encoding[v] = dict(filters)
+        chunks = chunksizes.get(v, default_chunksizes(ds[v]))
+        if chunks is not None:
+            encoding[v]["chunksizes"] = chunks
+    ds.to_netcdf(save_path, engine=engine, encoding=encoding)
+
+
 def load_obj(name):
     """Load something with Pickle."""
 
@@ -61,9 +129,111 @@ def sum_total_emissions(emissions, areas, mask):
     return float(total)
 
 
-def filter_obs_with_mask(mask, df):
+def sum_total_emissions_raw(emissions_x_areas, mask):
     """
-    Select observations lying within a boolean mask
+    Same as sum_total_emissions, but for NumPy arrays that are already on
+    the same grid and in the same dimension order. Skips xarray alignment
+    overhead when called many times in a loop, e.g. once per state vector
+    element with a fixed emissions * areas array.
+
+    Arguments:
+        emissions_x_areas : numpy array of emissions times grid-cell areas
+        mask              : numpy binary mask for the region of interest
+
+    Returns:
+        Total emissions in Tg/y
+    """
+
+    s_per_d = 86400
+    d_per_y = 365
+    tg_per_kg = 1e-9
+    total = np.nansum(emissions_x_areas * mask) * s_per_d * d_per_y * tg_per_kg
+    return float(total)
+
+
+def nearest_grid_index(reference_grid, query):
+    """
+    Find the index of the closest reference grid point for each query value.
+    reference_grid must be monotonically increasing (e.g. lat or lon centers)
+    Ties are resolved toward the lower index, as with np.abs(...).argmin()
+    """
+
+    idx = np.searchsorted(reference_grid, query)
+    idx = np.clip(idx, 1, len(reference_grid) - 1)
+
+    # Step back one cell wherever the lower neighbor is at least as close
+    lower = reference_grid[idx - 1]
+    upper = reference_grid[idx]
+    idx -= (query - lower) <= (upper - query)
+
+    return idx
+
+
+@lru_cache(maxsize=None)
+def _nearest_mask_kernel():
+    """
+    Compile the numba nearest-cell kernel on first use, so that importing
+    utils does not pay numba's import cost. Returns None without numba.
+    """
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    @njit(cache=True, parallel=True)
+    def kernel(lats, lons, ref_lat, ref_lon, mask_arr, out):
+        for k in prange(lats.size):
+            li = 0
+            best = abs(ref_lat[0] - lats[k])
+            for i in range(1, ref_lat.size):
+                d = abs(ref_lat[i] - lats[k])
+                if d < best:
+                    best = d
+                    li = i
+            lj = 0
+            best = abs(ref_lon[0] - lons[k])
+            for j in range(1, ref_lon.size):
+                d = abs(ref_lon[j] - lons[k])
+                if d < best:
+                    best = d
+                    lj = j
+            out[k] = mask_arr[li, lj]
+
+    return kernel
+
+
+def nearest_mask_lookup(reference_lat_grid, reference_lon_grid, mask_arr, lats, lons):
+    """
+    Boolean array that is True where the closest grid cell to each
+    observation is in the mask. Fallback for grids that are not
+    monotonically increasing, where np.searchsorted cannot be used.
+    Uses a compiled min-abs scan when numba is available, otherwise a
+    NumPy argmin per observation.
+    """
+
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+    ref_lat = np.ascontiguousarray(reference_lat_grid, dtype=np.float64)
+    ref_lon = np.ascontiguousarray(reference_lon_grid, dtype=np.float64)
+    mask_arr = np.ascontiguousarray(mask_arr, dtype=np.bool_)
+    out = np.empty(len(lats), dtype=np.bool_)
+
+    kernel = _nearest_mask_kernel()
+    if kernel is not None:
+        kernel(lats, lons, ref_lat, ref_lon, mask_arr, out)
+        return out
+
+    for k in range(len(lats)):
+        li = np.abs(ref_lat - lats[k]).argmin()
+        lj = np.abs(ref_lon - lons[k]).argmin()
+        out[k] = mask_arr[li, lj]
+
+    return out
+
+
+def _compute_keep_mask(mask, df):
+    """
+    Boolean array that is True for observations lying within a boolean mask
     mask is boolean xarray data array
     df is pandas dataframe with lat, lon, etc.
     """
@@ -75,21 +245,31 @@ def filter_obs_with_mask(mask, df):
     query_lats = df["lat"].values
     query_lons = df["lon"].values
 
-    # Loop
-    bad_ind = []
-    for k in range(len(df)):
-        # Find closest reference coordinates to selected lat/lon bounds
-        ref_lat_ind = np.abs(reference_lat_grid - query_lats[k]).argmin()
-        ref_lon_ind = np.abs(reference_lon_grid - query_lons[k]).argmin()
-        # If not in mask, save as bad index
-        if mask[ref_lat_ind, ref_lon_ind] == 0:
-            bad_ind.append(k)
+    # Keep only observations whose closest grid cell is in the mask
+    if np.all(np.diff(reference_lat_grid) > 0) and np.all(
+        np.diff(reference_lon_grid) > 0
+    ):
+        lat_idx = nearest_grid_index(reference_lat_grid, query_lats)
+        lon_idx = nearest_grid_index(reference_lon_grid, query_lons)
+        return mask.values[lat_idx, lon_idx].astype(bool)
+
+    return nearest_mask_lookup(
+        reference_lat_grid,
+        reference_lon_grid,
+        mask.values,
+        query_lats,
+        query_lons,
+    )
 
-    # Drop bad indexes and count remaining entries
-    df_filtered = df.copy()
-    df_filtered = df_filtered.drop(df_filtered.index[bad_ind])
 
-    return df_filtered
+def filter_obs_with_mask(mask, df):
+    """
+    Select observations lying within a boolean mask
+    mask is boolean xarray data array
+    df is pandas dataframe with lat, lon, etc.
+    """
+
+    return df[_compute_keep_mask(mask, df)]
 
 
 def count_obs_in_mask(mask, df):
@@ -99,10 +279,16 @@ def count_obs_in_mask(mask, df):
     df is pandas dataframe with lat, lon, etc.
     """
 
-    df_filtered = filter_obs_with_mask(mask, df)
-    n_obs = len(df_filtered)
+    return int(_compute_keep_mask(mask, df).sum())
+
+
+PLATE_CARREE = ccrs.PlateCarree()
 
-    return n_obs
+
+@lru_cache(maxsize=None)
+def natural_earth_feature(category, name, scale):
+    """Natural Earth feature, built once and reused across plot_field calls."""
+    return cartopy.feature.NaturalEarthFeature(category, name, scale)
 
 
 def plot_field(
@@ -142,9 +328,9 @@ def plot_field(
     """
 
     # Select map features
-    oceans_50m = cartopy.feature.NaturalEarthFeature("physical", "ocean", "50m")
-    lakes_50m = cartopy.feature.NaturalEarthFeature("physical", "lakes", "50m")
-    states_provinces_50m = cartopy.feature.NaturalEarthFeature(
+    oceans_50m = natural_earth_feature("physical", "ocean", "50m")
+    lakes_50m = natural_earth_feature("physical", "lakes", "50m")
+    states_provinces_50m = natural_earth_feature(
         "cultural", "admin_1_states_provinces_lines", "50m"
     )
     ax.add_feature(cartopy.feature.BORDERS, facecolor="none")
@@ -181,14 +367,14 @@ def plot_field(
     # Zoom on ROI?
     if lon_bounds and lat_bounds:
         extent = [lon_bounds[0], lon_bounds[1], lat_bounds[0], lat_bounds[1]]
-        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        ax.set_extent(extent, crs=PLATE_CARREE)
 
     # Show boundary of ROI?
     if mask is not None:
         mask.plot.contour(levels=1, colors="k", linewidths=4, ax=ax)
 
     # Remove duplicated axis labels
-    gl = ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=True, alpha=0)
+    gl = ax.gridlines(crs=PLATE_CARREE, draw_labels=True, alpha=0)
     gl.right_labels = False
     gl.top_labels = False
 
@@ -206,24 +392,78 @@ def filter_tropomi(tropomi_data, xlim, ylim, startdate, enddate):
     Returns:
         numpy array with satellite indices for filtered tropomi data.
     """
-    return np.where(
-        (tropomi_data["longitude"] > xlim[0])
-        & (tropomi_data["longitude"] < xlim[1])
-        & (tropomi_data["latitude"] > ylim[0])
-        & (tropomi_data["latitude"] < ylim[1])
-        & (tropomi_data["time"] >= startdate)
-        & (tropomi_data["time"] <= enddate)
-        & (tropomi_data["qa_value"] >= 0.5)
-        & (tropomi_data["longitude_bounds"].ptp(axis=2) < 100)
+    # Bind each field to a numpy array once, instead of once per comparison
+    lon = np.asarray(tropomi_data["longitude"])
+    lat = np.asarray(tropomi_data["latitude"])
+    time = np.asarray(tropomi_data["time"])
+    qa = np.asarray(tropomi_data["qa_value"])
+    lon_bounds = np.asarray(tropomi_data["longitude_bounds"])
+
+    # Spread of the pixel corner longitudes, subtracting in place so only
+    # the max and min reductions allocate
+    lon_ptp = np.max(lon_bounds, axis=-1)
+    lon_ptp -= np.min(lon_bounds, axis=-1)
+
+    # Evaluate all criteria in a single pass with numexpr
+    # numexpr has no datetime support, so compare times as int64 nanoseconds
+    ns_time = time.astype("datetime64[ns]", copy=False)
+    valid = ne.evaluate(
+        "(lon > x0) & (lon < x1) & (lat > y0) & (lat < y1)"
+        " & (t >= t0) & (t <= t1) & (qa >= 0.5) & (lon_ptp < 100)",
+        local_dict={
+            "lon": lon,
+            "lat": lat,
+            "t": ns_time.view("int64"),
+            "qa": qa,
+            "lon_ptp": lon_ptp,
+            "x0": xlim[0],
+            "x1": xlim[1],
+            "y0": ylim[0],
+            "y1": ylim[1],
+            "t0": np.datetime64(startdate, "ns").astype("int64"),
+            "t1": np.datetime64(enddate, "ns").astype("int64"),
+        },
     )
 
+    return np.nonzero(valid)
+
+
+def calculate_areas_in_km(polygons, earth_radius_km=6371.0088):
+    """
+    Description:
+        Calculate areas in km of many polygons at once, treating the Earth
+        as a sphere and polygon edges as great circles. Compared with the
+        ellipsoidal calculate_area_in_km, areas are within +/-0.5%
+        equatorward of ~55 degrees and down to -0.9% near the poles
+    Arguments
+        polygons  [array]: (n_polygons, n_vertices, 2) array of lon/lat
+                           coordinates in degrees, in polygon order
+        earth_radius_km [float]: radius of the sphere in km
+    Returns:
+        numpy array: area in km of each polygon
+    """
+
+    polygons = np.asarray(polygons, dtype=float)
+    lon1 = np.radians(polygons[..., 0])
+    lat1 = np.radians(polygons[..., 1])
+    lon2 = np.roll(lon1, -1, axis=-1)
+    lat2 = np.roll(lat1, -1, axis=-1)
+
+    # Signed spherical excess between each edge and the equator
+    dlon = (lon2 - lon1 + np.pi) % (2 * np.pi) - np.pi
+    t1 = np.tan(lat1 / 2)
+    t2 = np.tan(lat2 / 2)
+    excess = 2 * np.arctan2(np.tan(dlon / 2) * (t1 + t2), 1 + t1 * t2)
+
+    return np.abs(excess.sum(axis=-1)) * earth_radius_km**2
+
 
 def calculate_area_in_km(coordinate_list):
     """
     Description:
         Calculate area in km of a polygon given a list of coordinates
     Arguments
-        coordinate_list  [tuple]: list of lat/lon coordinates.
+        coordinate_list  [tuple]: list of lon/lat coordinates.
                          coordinates must be in correct polygon order
     Returns:
         int: area in km of polygon